@@ -26,6 +26,14 @@ BLEByteCharacteristic statusChar(STATUS_UUID, BLERead | BLENotify);
 const byte CMD_IDLE = 0;
 const byte CMD_START_CAPTURE = 1;
 const byte CMD_BUSY = 2;
+const byte CMD_START_CAPTURE_LARGE = 3;  // Same as CMD_START_CAPTURE, but send large data chunks
+
+// Samples per data notification. Small chunks fit the default 23-byte ATT MTU.
+// Large chunks (2 + 39 * 6 = 236 bytes, within the 240-byte characteristic)
+// need an ATT MTU of at least 239, so the Pi only asks for them once it has
+// negotiated one. Fewer notifications means less per-packet overhead.
+const int SMALL_SAMPLES_PER_CHUNK = 3;
+const int LARGE_SAMPLES_PER_CHUNK = 39;
 
 // Status codes we send back
 const byte STATUS_READY = 0;
@@ -38,6 +46,7 @@ const byte STATUS_ERROR = 6;
 
 // State variables
 bool captureRequested = false;
+bool largeChunksRequested = false;
 bool captureInProgress = false;
 unsigned long captureStartTime = 0;
 int currentSampleIndex = 0;
@@ -136,7 +145,8 @@ void onCommandWritten(BLEDevice central, BLECharacteristic characteristic) {
   byte command = 0;
   commandChar.readValue(command);
   
-  if (command == CMD_START_CAPTURE && !captureInProgress) {
+  if ((command == CMD_START_CAPTURE || command == CMD_START_CAPTURE_LARGE) && !captureInProgress) {
+    largeChunksRequested = (command == CMD_START_CAPTURE_LARGE);
     captureRequested = true;
   }
 }
@@ -224,15 +234,15 @@ void sendDataOverBLE() {
   BLE.poll();
   delay(10);
   
-  // Split data into small chunks for Bluetooth
-  const int SAMPLES_PER_CHUNK = 3;
-  const int TOTAL_CHUNKS = (SAMPLES_PER_CAPTURE + SAMPLES_PER_CHUNK - 1) / SAMPLES_PER_CHUNK;
+  // Split data into chunks for Bluetooth (small unless the Pi asked for large ones)
+  const int samplesPerChunk = largeChunksRequested ? LARGE_SAMPLES_PER_CHUNK : SMALL_SAMPLES_PER_CHUNK;
+  const int totalChunks = (SAMPLES_PER_CAPTURE + samplesPerChunk - 1) / samplesPerChunk;
   
-  byte buffer[20];
+  byte buffer[2 + LARGE_SAMPLES_PER_CHUNK * 6];
   int samplesSent = 0;
   
-  for (int chunk = 0; chunk < TOTAL_CHUNKS; chunk++) {
-    int samplesInChunk = min(SAMPLES_PER_CHUNK, SAMPLES_PER_CAPTURE - samplesSent);
+  for (int chunk = 0; chunk < totalChunks; chunk++) {
+    int samplesInChunk = min(samplesPerChunk, SAMPLES_PER_CAPTURE - samplesSent);
     
     // Chunk header
     buffer[0] = chunk;
@@ -8,13 +8,20 @@ IAB330 Assignment 2B - Raspberry Pi BLE Data Collector
 import asyncio
 import json
 import os
-import struct
 import time
-from typing import Dict, List, Optional
+from typing import Dict, Optional
 from datetime import datetime
 
+import numpy as np
 from bleak import BleakClient, BleakScanner
 
+try:
+    import orjson
+except ImportError:
+    # Optional; used for the dataset load, the journal lines and flush(), with
+    # json as the fallback for each.
+    orjson = None
+
 SERVICE_UUID = "19B10000-E8F2-537E-4F6C-D104768A1214"
 COMMAND_UUID = "19B10001-E8F2-537E-4F6C-D104768A1214"
 ACCEL_DATA_UUID = "19B10002-E8F2-537E-4F6C-D104768A1214"
@@ -33,6 +40,11 @@ STATUS_COMPLETE = 5
 STATUS_ERROR = 6
 
 EXPECTED_CHUNKS = 42  # 3-sample payloads * 42 ~= 125 samples
+SAMPLES_PER_CHUNK = 3
+
+# Sample wire format: 3 little-endian int16 values (x_mg, y_mg, z_mg) per sample
+SAMPLE_DTYPE = np.dtype('<i2')
+BYTES_PER_SAMPLE = 3 * SAMPLE_DTYPE.itemsize
 
 
 class GestureDataCollector:
@@ -40,12 +52,22 @@ class GestureDataCollector:
         self.client: Optional[BleakClient] = None
         self.device_address: Optional[str] = None
         self.data_file = data_file
+        # Saved captures are appended here (one JSON object per line) and only
+        # merged into data_file by flush(), so a save never rewrites the dataset
+        self.journal_file = data_file + ".journal"
         self.data = self.load_existing_data()
         if "data" not in self.data:
             self.data["data"] = {}
+        # Flushed even when nothing was recovered, so a torn line is never left for
+        # the next save to append onto
+        self.replay_journal()
+        self.flush()
 
         self.capture_in_progress = False
-        self.received_chunks: Dict[int, List[List[float]]] = {}
+        # Reassembly buffer: chunk `seq` lands in received_samples[seq] and its
+        # sample count in received_counts[seq] (0 = not received)
+        self.received_samples = np.zeros((EXPECTED_CHUNKS, SAMPLES_PER_CHUNK, 3), dtype=np.int16)
+        self.received_counts = np.zeros(EXPECTED_CHUNKS, dtype=np.intp)
         self.last_capture: Optional[Dict] = None
         self.expected_chunks = EXPECTED_CHUNKS
         self.current_letter: Optional[str] = None
@@ -57,8 +79,12 @@ class GestureDataCollector:
     def load_existing_data(self) -> Dict:
         if os.path.exists(self.data_file):
             try:
-                with open(self.data_file, "r", encoding="utf-8") as fh:
-                    data = json.load(fh)
+                if orjson is not None:
+                    with open(self.data_file, "rb") as fh:
+                        data = orjson.loads(fh.read())
+                else:
+                    with open(self.data_file, "r", encoding="utf-8") as fh:
+                        data = json.load(fh)
                 print(f"Loaded existing data from {self.data_file}")
                 return data
             except Exception as exc:
@@ -71,6 +97,61 @@ class GestureDataCollector:
             "data": {},
         }
 
+    def replay_journal(self) -> int:
+        """
+        Apply captures journaled by a previous session that did not flush.
+
+        Entries already in the dataset are skipped (a session that died between
+        writing data_file and removing the journal), so replaying twice is harmless.
+        """
+        if not os.path.exists(self.journal_file):
+            return 0
+
+        saved = {
+            (letter, cap.get("timestamp"))
+            for letter, content in self.data.get("data", {}).items()
+            for cap in content.get("captures", [])
+        }
+        replayed = 0
+        with open(self.journal_file, "rb") as fh:
+            for line in fh:
+                try:
+                    entry = orjson.loads(line) if orjson is not None else json.loads(line)
+                except ValueError:
+                    break  # Torn final line from an interrupted write
+                if (entry["letter"], entry["capture"]["timestamp"]) in saved:
+                    continue
+                self._add_capture(entry["letter"], entry["capture"])
+                self.data["last_modified"] = entry["last_modified"]
+                replayed += 1
+        print(f"Recovered {replayed} unflushed captures from {self.journal_file}")
+        return replayed
+
+    def flush(self) -> None:
+        """Write the consolidated dataset and clear the journal."""
+        if not os.path.exists(self.journal_file):
+            return
+
+        # Written next to data_file and renamed over it, so an interrupted write never
+        # leaves a truncated dataset; the journal is only removed once it is in place
+        tmp_file = self.data_file + ".tmp"
+        if orjson is not None:
+            with open(tmp_file, "wb") as fh:
+                fh.write(orjson.dumps(self.data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(tmp_file, "w", encoding="utf-8") as fh:
+                json.dump(self.data, fh, indent=2)
+        os.replace(tmp_file, self.data_file)
+        os.remove(self.journal_file)
+        print(f"Dataset written to {os.path.abspath(self.data_file)}")
+
+    def _add_capture(self, letter: str, capture: Dict) -> Dict:
+        data_root = self.data.setdefault("data", {})
+        letter_data = data_root.setdefault(letter, {"attempts": 0, "captures": []})
+        letter_data["captures"].append(capture)
+        letter_data["attempts"] = len(letter_data["captures"])
+        return letter_data
+
     def save_last_capture(self) -> bool:
         if not self.last_capture:
             print("No capture to save!")
@@ -79,26 +160,30 @@ class GestureDataCollector:
             print("No letter selected for training!")
             return False
 
-        data_root = self.data.setdefault("data", {})
-        letter_data = data_root.setdefault(self.current_letter, {"attempts": 0, "captures": []})
-
-        attempt_num = len(letter_data["captures"]) + 1
-        letter_data["captures"].append({
+        letter_captures = self.data.get("data", {}).get(self.current_letter, {}).get("captures", [])
+        attempt_num = len(letter_captures) + 1
+        capture = {
             "attempt": attempt_num,
             "timestamp": self.last_capture["timestamp"],
             "x": self.last_capture["x"],
             "y": self.last_capture["y"],
             "z": self.last_capture["z"],
-        })
-        letter_data["attempts"] = len(letter_data["captures"])
+        }
+        letter_data = self._add_capture(self.current_letter, capture)
         self.data["last_modified"] = datetime.now().isoformat()
 
-        with open(self.data_file, "w", encoding="utf-8") as fh:
-            json.dump(self.data, fh, indent=2)
+        # Append only this capture; the full dataset is rewritten once by flush()
+        entry = {"letter": self.current_letter, "capture": capture, "last_modified": self.data["last_modified"]}
+        if orjson is not None:
+            with open(self.journal_file, "ab") as fh:
+                fh.write(orjson.dumps(entry) + b"\n")
+        else:
+            with open(self.journal_file, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(entry, separators=(",", ":")) + "\n")
 
         print(f"SAVED: Letter '{self.current_letter}', Attempt #{attempt_num}")
         print(f"Total for {self.current_letter}: {letter_data['attempts']} attempts")
-        print(f"File: {os.path.abspath(self.data_file)}")
+        print(f"File: {os.path.abspath(self.journal_file)}")
 
         self.last_capture = None
         return True
@@ -140,7 +225,7 @@ class GestureDataCollector:
             await asyncio.sleep(2)
 
             self.capture_in_progress = False
-            self.received_chunks.clear()
+            self.received_counts.fill(0)
             self.capture_done.set()
 
             print(f"Connected to Arduino at {self.device_address}")
@@ -161,19 +246,16 @@ class GestureDataCollector:
             return
 
         sequence_num = data[0]
-        sample_count = data[1]
+        if sequence_num >= EXPECTED_CHUNKS:
+            return  # Not part of a capture layout we know about
 
-        samples: List[List[float]] = []
-        for i in range(sample_count):
-            base = 2 + i * 6
-            if base + 6 > len(data):
-                break
-            x = struct.unpack_from('<h', data, base)[0] / 1000.0
-            y = struct.unpack_from('<h', data, base + 2)[0] / 1000.0
-            z = struct.unpack_from('<h', data, base + 4)[0] / 1000.0
-            samples.append([x, y, z])
+        # Ignore a trailing partial sample if the chunk was cut short
+        sample_count = min(data[1], SAMPLES_PER_CHUNK, (len(data) - 2) // BYTES_PER_SAMPLE)
 
-        self.received_chunks[sequence_num] = samples
+        # Copy all (x_mg, y_mg, z_mg) int16 samples of the chunk into its slot in one call
+        samples = np.frombuffer(data, dtype=SAMPLE_DTYPE, count=sample_count * 3, offset=2)
+        self.received_samples[sequence_num, :sample_count] = samples.reshape(sample_count, 3)
+        self.received_counts[sequence_num] = sample_count
         
         # Show progress every 10 chunks
         if (sequence_num + 1) % 10 == 0:
@@ -208,7 +290,7 @@ class GestureDataCollector:
             print("GO! Perform your gesture now!")
             if not self.capture_in_progress:
                 self.capture_in_progress = True
-                self.received_chunks.clear()
+                self.received_counts.fill(0)
                 self.capture_done.clear()
         elif status == STATUS_COMPLETE:
             print("\nCapture finished!")
@@ -224,20 +306,16 @@ class GestureDataCollector:
 
     # Capture assembly
     def assemble_complete_capture(self) -> None:
-        if not self.received_chunks:
+        if not self.received_counts.any():
             print("Warning: No data received")
             self.capture_done.set()
             return
 
-        x_values: List[float] = []
-        y_values: List[float] = []
-        z_values: List[float] = []
-
-        for seq in sorted(self.received_chunks.keys()):
-            for x, y, z in self.received_chunks[seq]:
-                x_values.append(x)
-                y_values.append(y)
-                z_values.append(z)
+        # Select the received rows of every chunk (already in sequence order)
+        # and convert milligravity back to Gs
+        received = np.arange(SAMPLES_PER_CHUNK) < self.received_counts[:, np.newaxis]
+        samples = self.received_samples[received]
+        x_values, y_values, z_values = (samples / 1000.0).T.tolist()
 
         capture = {
             "timestamp": int(time.time() * 1000),
@@ -250,7 +328,7 @@ class GestureDataCollector:
 
         self.last_capture = capture
         self.capture_in_progress = False
-        self.received_chunks.clear()
+        self.received_counts.fill(0)
 
         if not self.capture_done.is_set():
             self.capture_done.set()
@@ -270,7 +348,7 @@ class GestureDataCollector:
             print("Capture already in progress")
             return False
 
-        self.received_chunks.clear()
+        self.received_counts.fill(0)
         self.last_capture = None
         self.capture_done.clear()
 
@@ -284,7 +362,7 @@ class GestureDataCollector:
 
     def reset_state(self) -> None:
         self.capture_in_progress = False
-        self.received_chunks.clear()
+        self.received_counts.fill(0)
         self.last_capture = None
         self.capture_done.set()
         print("State reset")
@@ -364,9 +442,10 @@ async def main() -> None:
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
+        collector.flush()
         await collector.disconnect()
 
 
 if __name__ == "__main__":
-    print("Requirements: pip install bleak")
+    print("Requirements: pip install bleak numpy")
     asyncio.run(main())
@@ -1,6 +1,5 @@
 import asyncio
 import numpy as np
-import struct
 import sys # Added for flushing print statements 1.. 2.. 3.. example
 from bleak import BleakClient
 from typing import List
@@ -15,10 +14,38 @@ STATUS_UUID = "19B10003-E8F2-537E-4F6C-D104768A1214"
 
 # Command and Status Codes
 CMD_START_CAPTURE = b'\x01' # Corresponds to CMD_START_CAPTURE = 1
+CMD_START_CAPTURE_LARGE = b'\x03' # Corresponds to CMD_START_CAPTURE_LARGE = 3
 STATUS_CAPTURING = 4        # Corresponds to STATUS_CAPTURING = 4
 STATUS_COMPLETE = 5         # Corresponds to STATUS_COMPLETE = 5
 SAMPLES_PER_CAPTURE = 125   # Corresponds to SAMPLES_PER_CAPTURE = 125
 
+# Sample wire format: 3 little-endian int16 values (x_mg, y_mg, z_mg) per sample.
+# Built once here so the notification handler doesn't re-parse it per chunk.
+SAMPLE_DTYPE = np.dtype('<i2')
+BYTES_PER_SAMPLE = 3 * SAMPLE_DTYPE.itemsize  # 6 bytes
+
+# Large data chunks: 39 samples per notification (4 notifications per capture
+# instead of 42). A notification carries at most (ATT MTU - 3) bytes.
+LARGE_CHUNK_SAMPLES = 39    # Corresponds to LARGE_SAMPLES_PER_CHUNK = 39
+LARGE_CHUNK_MIN_MTU = 3 + 2 + LARGE_CHUNK_SAMPLES * BYTES_PER_SAMPLE  # 239 bytes
+
+
+async def negotiate_mtu(client: BleakClient) -> int:
+    """
+    Returns the connection's ATT MTU, exchanging it with the Arduino first on BlueZ.
+    
+    BlueZ reports the 23-byte default until the MTU is acquired; the other
+    backends negotiate it while connecting.
+    """
+    acquire_mtu = getattr(client._backend, "_acquire_mtu", None)
+    if acquire_mtu is not None:
+        try:
+            await acquire_mtu()
+        except Exception as e:
+            print(f"BLE WARNING: MTU exchange failed, using small data chunks. {e}")
+    return client.mtu_size
+
+
 async def capture_new_gesture_async(address: str):
     """
     Asynchronous core function to manage the BLE connection and data transfer.
@@ -27,7 +54,7 @@ async def capture_new_gesture_async(address: str):
     """
     
     # === LOCAL STATE INIT (Bound to the current event loop) ===
-    gesture_points = []
+    gesture_chunks: List[np.ndarray] = []
     status_event = asyncio.Event()
     # ==========================================================
 
@@ -58,33 +85,19 @@ async def capture_new_gesture_async(address: str):
 
     # 1. Define data handler as a closure
     def data_notification_handler(sender: int, data: bytearray):
-        """Callback for receiving gesture data chunks, modifies the local 'gesture_points'."""
+        """Callback for receiving gesture data chunks, modifies the local 'gesture_chunks'."""
         if len(data) < 2: return 
         
         samples_in_chunk = data[1]
-        payload = data[2:]
-        bytes_per_sample = 6 
         
-        try:
-            for i in range(samples_in_chunk):
-                start = i * bytes_per_sample
-                end = start + bytes_per_sample
-                
-                # Unpack 3 short integers (x_mg, y_mg, z_mg)
-                x_mg, y_mg, z_mg = struct.unpack('<hhh', payload[start:end])
-                
-                # Convert from milligravity (mg) back to Gs (float)
-                x_g = x_mg / 1000.0
-                y_g = y_mg / 1000.0 
-                z_g = z_mg / 1000.0
-                
-                # Append to the local list
-                gesture_points.append((x_g, y_g, z_g)) 
-                
-        except struct.error:
-            # This handles cases where a chunk might be partial or corrupted.
-            # It prevents the error from propagating up and killing the BLE message loop.
-            return
+        # Drop partial or corrupted chunks up front so nothing can raise inside
+        # the callback and kill the BLE message loop.
+        if 2 + samples_in_chunk * BYTES_PER_SAMPLE > len(data): return
+        
+        # View the payload as (samples, 3) int16 milligravity values (x_mg, y_mg, z_mg)
+        # in one call; the conversion to Gs happens once the capture is complete.
+        chunk = np.frombuffer(data, dtype=SAMPLE_DTYPE, count=samples_in_chunk * 3, offset=2)
+        gesture_chunks.append(chunk.reshape(samples_in_chunk, 3))
 
     # 2. Define status handler as a closure
     def status_notification_handler(sender: int, data: bytearray):
@@ -108,12 +121,16 @@ async def capture_new_gesture_async(address: str):
             print("Connection established. Waiting for countdown...")
             sys.stdout.flush()
 
+            # Ask for large data chunks only if the MTU can carry them
+            mtu = await negotiate_mtu(client)
+            start_command = CMD_START_CAPTURE_LARGE if mtu >= LARGE_CHUNK_MIN_MTU else CMD_START_CAPTURE
+
             # Start listening using the locally defined handlers
             await client.start_notify(ACCEL_DATA_UUID, data_notification_handler)
             await client.start_notify(STATUS_UUID, status_notification_handler)
             
             # Send the START_CAPTURE command
-            await client.write_gatt_char(COMMAND_UUID, CMD_START_CAPTURE, response=True)
+            await client.write_gatt_char(COMMAND_UUID, start_command, response=True)
             
             # Wait for the status_event (local and correctly bound)
             await asyncio.wait_for(status_event.wait(), timeout=15.0) # Increased timeout slightly for safety
@@ -122,8 +139,13 @@ async def capture_new_gesture_async(address: str):
             await client.stop_notify(ACCEL_DATA_UUID)
             await client.stop_notify(STATUS_UUID)
             
-            # Return the local data
-            return np.array(gesture_points)
+            # Return the local data, converted from milligravity (mg) back to Gs (float)
+            if not gesture_chunks:
+                return np.empty((0, 3), dtype=np.float32)
+            # One bulk int16 -> float32 cast, then scale that same array in place
+            gesture_points = np.concatenate(gesture_chunks).astype(np.float32)
+            gesture_points *= 0.001
+            return gesture_points
 
     except asyncio.TimeoutError:
         print("\nBLE ERROR: Capture timed out (15s limit reached). Check Arduino status and range.")
@@ -2,11 +2,24 @@ import numpy as np
 from scipy.stats import median_abs_deviation as mad
 from scipy.signal import find_peaks
 
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba is optional: without it extract_features falls back to plain NumPy.
+    njit = None
+    prange = range
+
 # --- Configuration for Active Time Fraction ---
 # The threshold should be determined experimentally, often 0.2g to 0.5g
 ACTIVITY_THRESHOLD_G = 0.5 # Example: 0.3g (300 mg)
 # ---------------------------------------------
 
+# 11 per-axis features * 3 axes + 7 magnitude features + 2 global features
+NUM_FEATURES = 42
+# Windows and feature vectors are float32: plenty for milligravity-resolution
+# data, and half the memory traffic of float64 for extraction and inference
+FEATURE_DTYPE = np.float32
+
 def extract_features(window: np.ndarray) -> np.ndarray:
     """
     Computes the 42 required time-domain features from an IMU window (X, Y, Z).
@@ -19,78 +32,374 @@ def extract_features(window: np.ndarray) -> np.ndarray:
         window: An array of shape (N, 3) containing [X, Y, Z] acceleration data (in Gs).
         
     Returns:
-        A 1D feature vector of length 42.
+        A 1D float32 feature vector of length 42.
     """
-    feats = []
+    window = np.ascontiguousarray(window, dtype=FEATURE_DTYPE)
+    if _extract_features_nb is not None:
+        return _extract_features_nb(window)
+    return _extract_features_np(window)
 
-    # --- 1. Gravity Compensation ---
-    # The mean of the signal window approximates the static gravity vector.
-    gravity_vector = np.mean(window, axis=0) 
-    window_compensated = window - gravity_vector
+
+def _gravity_py(window):
+    """
+    Per-axis float64 mean of one window, summed strictly in sample order.
     
-    # 2. Orientation-Independent Signal: Magnitude (Calculated from RAW signal)
-    # The magnitude still includes the 1G component, useful for Signal Energy.
-    magnitude = np.sqrt(np.sum(window**2, axis=1))
+    Compiled without fastmath (which would reorder the sum), so it gives
+    bit-for-bit the same gravity vector as the cumsum in _extract_features_batch_np.
+    The zero-crossing counts depend on it: a sample equal to the mean must
+    compensate to exactly 0 in both backends, not to 0 in one and -1e-17 in the other.
+    """
+    n = window.shape[0]
+    gravity = np.zeros(3)
+    for i in range(n):
+        for axis in range(3):
+            gravity[axis] += window[i, axis]
+    return gravity / n
 
-    # --- A. Per-Axis Statistics (33 Features - Uses COMPENSATED Signal) ---
+
+if njit is not None:
+    _gravity_nb = njit(cache=True)(_gravity_py)
+else:
+    _gravity_nb = None
+
+
+def _extract_features_py(window):
+    """
+    Loop-fused version of _extract_features_np, compiled with Numba when available.
+    
+    After the gravity mean, every per-axis statistic is accumulated in a single
+    pass over the samples instead of one NumPy reduction per feature. Sums are
+    accumulated in float64 and only the final features are stored as float32.
+    """
+    n = window.shape[0]
+    if n < 3:
+        raise ValueError("extract_features needs at least 3 samples for the jerk features")
+
+    feats = np.empty(NUM_FEATURES, dtype=FEATURE_DTYPE)
+
+    # Magnitude (Calculated from RAW signal), with its statistics streamed in the
+    # same pass. The variance sums are taken relative to the first sample
+    # (shifted data), which keeps the one-pass variance numerically stable.
+    magnitude = np.empty(n)
+    m_shift = np.sqrt(np.float64(window[0, 0])**2 + np.float64(window[0, 1])**2 + np.float64(window[0, 2])**2)
+    m_sum_d = 0.0
+    m_sum_d2 = 0.0
+    m_sum_sq = 0.0
+    m_min = m_shift
+    m_max = m_shift
+    active_samples = 0
+    for i in range(n):
+        sq = np.float64(window[i, 0])**2 + np.float64(window[i, 1])**2 + np.float64(window[i, 2])**2
+        m = np.sqrt(sq)
+        magnitude[i] = m
+        d = m - m_shift
+        m_sum_d += d
+        m_sum_d2 += d * d
+        m_sum_sq += sq
+        m_min = min(m_min, m)
+        m_max = max(m_max, m)
+        if m > ACTIVITY_THRESHOLD_G:
+            active_samples += 1
+
+    # Gravity Compensation: the mean approximates the static gravity component
+    gravity = _gravity_nb(window)
+
+    # --- A. Per-Axis Statistics (Uses COMPENSATED Signal) ---
     for axis in range(3):
-        # *** USING The GRAVITY-COMPENSATED SIGNAL HERE ***
-        x = window_compensated[:, axis]
-        
-        # --- Feature Swaps for Robustness ---        
-        # ADDED: Jerk features (derivative of the difference)
-        # Jerk is the second difference (rate of change of acceleration)
-        diff_x = np.diff(x)
-        jerk_x = np.diff(diff_x)
-        # 1. Max Absolute Jerk (Helps distinguish smooth vs sharp motions)
-        feats.append(np.max(np.abs(jerk_x))) 
-        
-        # Standard Deviation (variability/spread)
-        feats.append(np.std(x))
-        
-        # Variance
-        feats.append(np.var(x))
-        
-        # Min, Max, Peak-to-Peak Range (overall scale)
-        feats.append(np.min(x))
-        feats.append(np.max(x))
-        feats.append(np.ptp(x))
-        
-        # RMS and Signal Energy
-        feats.append(np.sqrt(np.mean(x**2))) # RMS
-        feats.append(np.sum(x**2))           # Energy
+        g = gravity[axis]
+
+        sum_sq = 0.0
+        mn = window[0, axis] - g
+        mx = mn
+        abs_diff_sum = 0.0
+        abs_diff_max = 0.0
+        abs_jerk_max = 0.0
+        zero_crossings = 0
+        prev = 0.0
+        prev_diff = 0.0
+        for i in range(n):
+            x = window[i, axis] - g
+            sum_sq += x * x
+            mn = min(mn, x)
+            mx = max(mx, x)
+            if i > 0:
+                d = x - prev
+                abs_diff_sum += abs(d)
+                abs_diff_max = max(abs_diff_max, abs(d))
+                if i > 1:
+                    abs_jerk_max = max(abs_jerk_max, abs(d - prev_diff))
+                if prev * x < 0:
+                    zero_crossings += 1
+                prev_diff = d
+            prev = x
+
+        var = sum_sq / n
+        base = axis * 11
+        feats[base + 0] = abs_jerk_max
+        feats[base + 1] = np.sqrt(var)
+        feats[base + 2] = var
+        feats[base + 3] = mn
+        feats[base + 4] = mx
+        feats[base + 5] = mx - mn
+        feats[base + 6] = np.sqrt(sum_sq / n)  # RMS
+        feats[base + 7] = sum_sq               # Energy
+        feats[base + 8] = abs_diff_sum / (n - 1)
+        feats[base + 9] = abs_diff_max
+        feats[base + 10] = zero_crossings
+
+    # --- B. Magnitude Statistics (Uses RAW Magnitude Signal) ---
+    m_mean = m_shift + m_sum_d / n
+    m_var = max(m_sum_d2 - m_sum_d * m_sum_d / n, 0.0) / n
+
+    feats[33] = m_mean
+    feats[34] = np.median(magnitude)
+    feats[35] = np.sqrt(m_var)
+    feats[36] = m_var
+    feats[37] = m_max - m_min
+    feats[38] = np.sqrt(m_sum_sq / n)  # RMS of Magnitude
+    feats[39] = m_sum_sq               # Energy of Magnitude
+
+    # --- C. Global & Composite Features ---
+    std_max = max(feats[1], max(feats[12], feats[23]))
+    std_min = min(feats[1], min(feats[12], feats[23]))
+    feats[40] = std_max / (std_min + 1e-6)
+    feats[41] = active_samples / n
+
+    return feats
+
+
+if njit is not None:
+    _extract_features_nb = njit(cache=True, fastmath=True)(_extract_features_py)
+else:
+    _extract_features_nb = None
+
+
+def _extract_features_ragged_py(points, offsets):
+    """Per-window kernel loop, compiled with prange to spread windows across cores."""
+    feats = np.empty((offsets.shape[0] - 1, NUM_FEATURES), dtype=FEATURE_DTYPE)
+    for b in prange(offsets.shape[0] - 1):
+        feats[b] = _extract_features_nb(points[offsets[b]:offsets[b + 1]])
+    return feats
+
+
+if njit is not None:
+    _extract_features_ragged_nb = njit(cache=True, fastmath=True, parallel=True)(_extract_features_ragged_py)
+else:
+    _extract_features_ragged_nb = None
+
+
+def extract_features_batch(windows: np.ndarray) -> np.ndarray:
+    """
+    Computes the 42 features for a batch of equal-length IMU windows at once.
+    
+    Args:
+        windows: An array of shape (B, N, 3) holding B windows of [X, Y, Z] data (in Gs).
         
-        # First-Difference Statistics (sharpness/jerk)
-        feats.append(np.mean(np.abs(diff_x))) # Mean Absolute Difference (|Δ|)
-        feats.append(np.max(np.abs(diff_x)))  # Max Absolute Difference (|Δ|)
+    Returns:
+        A (B, 42) float32 feature matrix; row b equals extract_features(windows[b]).
+    """
+    windows = np.ascontiguousarray(windows, dtype=FEATURE_DTYPE)
+    if _extract_features_ragged_nb is not None:
+        n_windows, n_samples = windows.shape[:2]
+        # A contiguous (B, N, 3) batch is already a ragged buffer with regular offsets
+        offsets = np.arange(n_windows + 1) * n_samples
+        return extract_features_ragged(windows.reshape(-1, 3), offsets)
+    return _extract_features_batch_np(windows)
+
+
+def extract_features_ragged(points: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Computes the 42 features for a batch of IMU windows of different lengths.
+    
+    The windows are stored back to back in one flat buffer (no padding), like the
+    rows of a CSR matrix. The buffer may be in either memory layout; the loaders
+    fill an axis-major (3, total_samples) array and pass its .T view, which keeps
+    each axis contiguous for the NumPy reductions and is used without a copy.
+    
+    Args:
+        points: An array of shape (total_samples, 3) of [X, Y, Z] data (in Gs);
+                window b is points[offsets[b]:offsets[b + 1]].
+        offsets: An integer array of shape (B + 1,) of window start positions,
+                 ending with total_samples.
         
-        # Zero-crossing Rate (directional reversals)
-        # Uses the compensated signal which is now centered around zero.
-        zero_crossings = np.sum((x[:-1] * x[1:]) < 0)
-        feats.append(zero_crossings)
+    Returns:
+        A (B, 42) float32 feature matrix; row b equals
+        extract_features(points[offsets[b]:offsets[b + 1]]).
+    """
+    points = np.asarray(points, dtype=FEATURE_DTYPE)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    lengths = np.diff(offsets)
+    # Checked up front: exceptions raised inside a prange loop do not propagate cleanly
+    if lengths.size and lengths.min() < 3:
+        raise ValueError("extract_features needs at least 3 samples for the jerk features")
+    if _extract_features_ragged_nb is not None:
+        return _extract_features_ragged_nb(points, offsets)
+
+    # Captures normally all have the firmware's fixed length: then the span the
+    # offsets cover already is a (B, N, 3) batch, and a reshape views it without
+    # copying (in either layout, since only the sample axis is split)
+    if lengths.size and lengths.min() == lengths.max():
+        span = points[offsets[0]:offsets[-1]]
+        return _extract_features_batch_np(span.reshape(lengths.size, lengths[0], 3))
+
+    # Without Numba, windows of equal length are gathered into one (B_n, n, 3)
+    # batch and go through the NumPy batch path together. The gather runs per
+    # axis, so the batch comes out axis-major, as _extract_features_batch_np wants.
+    feats = np.empty((lengths.size, NUM_FEATURES), dtype=FEATURE_DTYPE)
+    for n in np.unique(lengths):
+        rows = np.flatnonzero(lengths == n)
+        batch = points.T[:, offsets[rows, np.newaxis] + np.arange(n)]
+        feats[rows] = _extract_features_batch_np(np.moveaxis(batch, 0, 2))
+    return feats
+
+
+def extract_capture_features(data: dict):
+    """
+    Computes the (X, y) feature matrix and labels for every capture in a dataset.
+    
+    Shared by training and the deployment integrity check, so both see exactly the
+    same rows: empty captures are skipped, the rest keep the dataset's order.
+    
+    Args:
+        data: The dataset's "data" mapping of letter -> {"captures": [...]}, where
+              each capture holds "x", "y" and "z" lists of acceleration data (in Gs).
         
-        # Total per-axis features: 11 features/axis * 3 axes = 33
+    Returns:
+        A (B, 42) float32 feature matrix and a (B,) array of letters.
+    """
+    captures = [(letter, cap) for letter, content in data.items() for cap in content["captures"] if len(cap["x"]) > 0]
+
+    # All captures back to back in one flat buffer, stored axis-major as (3, total_samples):
+    # capture i occupies axes[:, offsets[i]:offsets[i + 1]]
+    offsets = np.zeros(len(captures) + 1, dtype=np.intp)
+    np.cumsum([len(cap["x"]) for _, cap in captures], out=offsets[1:])
+    axes = np.empty((3, offsets[-1]), dtype=FEATURE_DTYPE)
+    for i, (_, cap) in enumerate(captures):
+        # Each axis list is copied into one contiguous row slice, with no (N,3) temporary
+        start, stop = offsets[i], offsets[i + 1]
+        axes[0, start:stop] = cap["x"]
+        axes[1, start:stop] = cap["y"]
+        axes[2, start:stop] = cap["z"]
+
+    # axes.T is a (total_samples, 3) view; one compiled, parallel pass with Numba
+    X = extract_features_ragged(axes.T, offsets)
+    y = np.array([letter for letter, _ in captures])
+    return X, y
+
+
+def _extract_features_np(window: np.ndarray) -> np.ndarray:
+    """NumPy implementation of extract_features, used when Numba is not installed."""
+    return _extract_features_batch_np(window[np.newaxis])[0]
+
+
+def _median_rows(values: np.ndarray) -> np.ndarray:
+    """
+    Exact per-row median of a 2D array using np.partition.
+    
+    Selecting the middle element(s) skips the NaN checks and generic reduction
+    plumbing of np.median, which dominate its cost on windows of ~100 samples.
+    """
+    n = values.shape[1]
+    half = n // 2
+    if n % 2:
+        return np.partition(values, half, axis=1)[:, half]
+    # Even length: the median is the mean of the two middle order statistics
+    part = np.partition(values, (half - 1, half), axis=1)
+    return 0.5 * (part[:, half - 1] + part[:, half])
+
+
+def _extract_features_batch_np(windows: np.ndarray) -> np.ndarray:
+    """
+    NumPy implementation of extract_features_batch.
+    
+    Every statistic is a single reduction over the sample axis (axis=1), so the
+    Python overhead is paid once per batch rather than once per window and axis.
+    """
+    n_windows, n_samples = windows.shape[:2]
+    if n_samples < 3:
+        raise ValueError("extract_features needs at least 3 samples for the jerk features")
+
+    # Axis-major (structure-of-arrays) memory, still indexed as (B, N, 3): every
+    # reduction below runs along the sample axis, which is then unit-stride instead
+    # of stepping over the interleaved X/Y/Z values. A no-op if already in this layout.
+    windows = np.moveaxis(np.ascontiguousarray(np.moveaxis(windows, 2, 0)), 0, 2)
+
+    feats = np.empty((n_windows, NUM_FEATURES), dtype=FEATURE_DTYPE)
+
+    # --- 1. Gravity Compensation ---
+    # The mean of the signal window approximates the static gravity vector. It is
+    # a sequential float64 sum (cumsum) rather than np.mean's pairwise one, to match
+    # _gravity_py exactly (see the zero crossings below).
+    gravity_vector = np.cumsum(windows, axis=1, dtype=np.float64)[:, -1:] / n_samples
+    window_compensated = windows - gravity_vector.astype(FEATURE_DTYPE)
+    
+    # 2. Orientation-Independent Signal: Magnitude (Calculated from RAW signal)
+    # The magnitude still includes the 1G component, useful for Signal Energy.
+    # einsum forms the squared norms directly, without a windows**2 temporary.
+    magnitude = np.sqrt(np.einsum('bij,bij->bi', windows, windows))
+
+    # --- A. Per-Axis Statistics (33 Features - Uses COMPENSATED Signal) ---
+    # Each statistic is computed for all windows and axes in one call and written
+    # into a (B, 3, 11) view of the feature matrix: 11 features per window and axis.
+    per_axis = feats[:, :33].reshape(n_windows, 3, 11)
+
+    # --- Feature Swaps for Robustness ---
+    # ADDED: Jerk features (derivative of the difference)
+    # Jerk is the second difference (rate of change of acceleration)
+    diffs = np.diff(window_compensated, axis=1)
+    jerks = np.diff(diffs, axis=1)
+
+    # Computed once and shared by several features below
+    abs_diffs = np.abs(diffs)
+    energy = np.einsum('bij,bij->bj', window_compensated, window_compensated)
+    var = np.var(window_compensated, axis=1)
+    mins = np.min(window_compensated, axis=1)
+    maxs = np.max(window_compensated, axis=1)
+
+    per_axis[:, :, 0] = np.max(np.abs(jerks), axis=1)    # 1. Max Absolute Jerk (smooth vs sharp motions)
+    per_axis[:, :, 1] = np.sqrt(var)                     # Standard Deviation (variability/spread)
+    per_axis[:, :, 2] = var                              # Variance
+    per_axis[:, :, 3] = mins                             # Min, Max, Peak-to-Peak Range (overall scale)
+    per_axis[:, :, 4] = maxs
+    per_axis[:, :, 5] = maxs - mins
+    per_axis[:, :, 6] = np.sqrt(energy / n_samples)      # RMS
+    per_axis[:, :, 7] = energy                           # Energy
+    per_axis[:, :, 8] = abs_diffs.mean(axis=1)           # Mean Absolute Difference (|Δ|)
+    per_axis[:, :, 9] = abs_diffs.max(axis=1)            # Max Absolute Difference (|Δ|)
+
+    # Zero-crossing Rate (directional reversals)
+    # A crossing is a sign change of the compensated signal, i.e. consecutive samples
+    # on opposite sides of the mean. Compared against the float64 gravity_vector, as
+    # in the Numba kernel, so samples equal to the mean count the same in both.
+    above = windows > gravity_vector
+    below = windows < gravity_vector
+    crossings = (above[:, :-1] & below[:, 1:]) | (below[:, :-1] & above[:, 1:])
+    per_axis[:, :, 10] = np.sum(crossings, axis=1)
+
+    # Total per-axis features: 11 features/axis * 3 axes = 33
 
     # --- B. Magnitude Statistics (7 Features - Uses RAW Magnitude Signal) ---
-    feats.append(np.mean(magnitude))
-    feats.append(np.median(magnitude))
-    feats.append(np.std(magnitude))
-    feats.append(np.var(magnitude))
-    feats.append(np.ptp(magnitude))
-    feats.append(np.sqrt(np.mean(magnitude**2))) # RMS of Magnitude
-    feats.append(np.sum(magnitude**2))           # Energy of Magnitude
+    energy_magnitude = np.einsum('bi,bi->b', magnitude, magnitude)
+    var_magnitude = np.var(magnitude, axis=1)
+    feats[:, 33] = np.mean(magnitude, axis=1)
+    feats[:, 34] = _median_rows(magnitude)
+    feats[:, 35] = np.sqrt(var_magnitude)
+    feats[:, 36] = var_magnitude
+    feats[:, 37] = np.ptp(magnitude, axis=1)
+    feats[:, 38] = np.sqrt(energy_magnitude / n_samples)  # RMS of Magnitude
+    feats[:, 39] = energy_magnitude                       # Energy of Magnitude
 
     # --- C. Global & Composite Features (2 Features) ---
 
     # Dominant-axis Ratio (compares variability across COMPENSATED axes)
-    stds_compensated = [np.std(window_compensated[:, i]) for i in range(3)]
+    # The per-axis standard deviations were already stored in column 1
+    stds_compensated = per_axis[:, :, 1]
     # Add a small epsilon (1e-6) to prevent division by zero
-    feats.append(max(stds_compensated) / (min(stds_compensated) + 1e-6))
+    feats[:, 40] = np.max(stds_compensated, axis=1) / (np.min(stds_compensated, axis=1) + 1e-6)
     
     # Active Time Fraction (proportion of time above a threshold)
-    active_samples = np.sum(magnitude > ACTIVITY_THRESHOLD_G)
-    active_time_fraction = active_samples / len(magnitude)
-    feats.append(active_time_fraction)
+    active_samples = np.sum(magnitude > ACTIVITY_THRESHOLD_G, axis=1)
+    feats[:, 41] = active_samples / n_samples
     
     # Final feature count remains 42
-    return np.array(feats)
+    return feats
@@ -1,13 +1,23 @@
 import joblib
 import numpy as np
 import json
+import os
+import zipfile
+from itertools import combinations
 from pathlib import Path
 from sklearn.model_selection import train_test_split 
 from sklearn.metrics import accuracy_score
 
+try:
+    import orjson
+except ImportError:
+    # Optional; speeds up parsing the dataset for the startup validation test.
+    orjson = None
+
 # === CRITICAL IMPORTS ===
 # 1. Feature logic (must be in features.py)
-from features import extract_features 
+import features
+from features import extract_features, extract_capture_features, NUM_FEATURES, FEATURE_DTYPE
 # 2. The BLE capture function (must be in ble_capture_module.py)
 from ble_capture_module import capture_new_gesture 
 # ========================
@@ -26,6 +36,8 @@ MODEL_PATH = MODEL_DIR / "SVC_BEST_SVC_C100_gesture_model.pkl"
 SCALER_PATH = MODEL_DIR / "scaler.pkl"
 # Re-adding DATA_PATH for the required run_validation_test function 
 DATA_PATH = Path("data/merged_sitting_lying.json") # *** Make sure this is the SAME as train_from_merged.py ***
+# Extracted validation features, reused while the data file and features.py are unchanged
+VALIDATION_CACHE_PATH = MODEL_DIR / "validation_cache.npz"
 
 model = None
 scaler = None
@@ -36,34 +48,90 @@ try:
     scaler = joblib.load(SCALER_PATH)
     print(f"✅ Loaded model: {MODEL_PATH.name}")
     print(f"✅ Loaded scaler: {SCALER_PATH.name}")
+    # Match the scaler statistics to the float32 features so in-place scaling
+    # never upcasts. (SVC support vectors stay float64: libsvm requires it.)
+    scaler.mean_ = scaler.mean_.astype(FEATURE_DTYPE)
+    scaler.scale_ = scaler.scale_.astype(FEATURE_DTYPE)
 except Exception as e:
     # NOTE: If this fails, check your training script's save path/name
     print(f"FATAL ERROR: Could not load files. Ensure training completed. {e}")
     exit()
 
+# Single feature row reused by every live prediction (scaled in place)
+_X_BUF = np.empty((1, NUM_FEATURES), dtype=FEATURE_DTYPE)
+
+# === One-vs-One Fast Path (multiclass SVC with probability=True) ===
+# libsvm predicts by majority vote over the pairwise (one-vs-one) classifiers, and
+# its probabilities start from a Platt sigmoid on each pairwise decision value. One
+# decision_function call therefore gives the label and, for clear-cut gestures, a
+# confidence estimate, without running predict() and predict_proba() separately.
+_OVO_PAIRS = None
+if getattr(model, "probA_", np.empty(0)).size and len(model.classes_) > 2:
+    # 'ovo' returns the raw pairwise values; the default 'ovr' reshaping costs more
+    # than predict() itself. predict() and predict_proba() are unaffected.
+    model.decision_function_shape = "ovo"
+    # Pair order used by libsvm: (0, 1), (0, 2), ..., (1, 2), ...
+    _OVO_PAIRS = np.array(list(combinations(range(len(model.classes_)), 2))).T
+
+
+def _scale_features_inplace(X: np.ndarray) -> np.ndarray:
+    """
+    Applies the loaded StandardScaler to X in place and returns X.
+    
+    Same math as scaler.transform(X), but without sklearn's per-call input
+    validation and output allocation, which dominate for a single 42-feature row.
+    """
+    np.subtract(X, scaler.mean_, out=X)
+    np.divide(X, scaler.scale_, out=X)
+    return X
+
+
+def load_validation_features(data_path: Path):
+    """
+    Returns the (X, y) feature matrix and labels for every capture in data_path.
+    
+    The result is cached in VALIDATION_CACHE_PATH and reused on the next start as
+    long as neither the data file nor features.py has been modified since.
+    """
+    cache_key = np.array([data_path.stat().st_mtime, Path(features.__file__).stat().st_mtime])
+
+    try:
+        with np.load(VALIDATION_CACHE_PATH) as cache:
+            if np.array_equal(cache["key"], cache_key):
+                return cache["X"], cache["y"]
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        pass  # Missing, unreadable or truncated cache: extract again below
+
+    if orjson is not None:
+        data = orjson.loads(data_path.read_bytes())["data"]
+    else:
+        with open(data_path, "r", encoding="utf-8") as f:
+            data = json.load(f)["data"]
+
+    # Feature extraction (the same function as training)
+    X, y = extract_capture_features(data)
+
+    # Written next to the cache and then renamed over it, so an interrupted write
+    # never leaves a partial file at VALIDATION_CACHE_PATH
+    tmp_path = VALIDATION_CACHE_PATH.with_name(VALIDATION_CACHE_PATH.stem + ".tmp.npz")
+    try:
+        np.savez(tmp_path, X=X, y=y, key=cache_key)
+        os.replace(tmp_path, VALIDATION_CACHE_PATH)
+    except OSError as e:
+        print(f"Warning: Could not write validation cache: {e}")
+
+    return X, y
+
 
 def run_validation_test(data_path: Path):
     """Diagnostic check to confirm model integrity against the test set."""
     print("\n--- Running Validation Test on Original Data ---")
     
     try:
-        with open(data_path, "r", encoding="utf-8") as f:
-            data = json.load(f)["data"]
+        X, y = load_validation_features(data_path)
     except FileNotFoundError:
         print(f"Validation failed: Data file not found at {data_path}")
         return
-
-    # Feature extraction (must be same as training)
-    X, y = [], []
-    for letter, content in data.items():
-        for cap in content["captures"]:
-            x = np.array([cap["x"], cap["y"], cap["z"]]).T
-            feats = extract_features(x)
-            X.append(feats)
-            y.append(letter)
-
-    X = np.array(X)
-    y = np.array(y)
     
     # Use SAME random_state=42 and test_size=0.2 as training
     X_train, X_test, y_train, y_test = train_test_split(
@@ -81,6 +149,26 @@ def run_validation_test(data_path: Path):
     print("-" * 50)
 
 
+def _ovo_vote(decision: np.ndarray):
+    """
+    Returns (class index, confidence estimate) from one row of 'ovo' decision values.
+    
+    The index is libsvm's own vote (ties go to the lowest class index), so it always
+    matches model.predict. The confidence combines the winner's pairwise Platt
+    probabilities r_j as 1 / (1 + sum((1 - r_j) / r_j)); once it clears 0.99 it is a
+    slightly conservative estimate of predict_proba for the winner.
+    """
+    first, second = _OVO_PAIRS
+    votes = np.bincount(np.where(decision > 0, first, second), minlength=len(model.classes_))
+    winner = np.argmax(votes)
+
+    # Probability that the first class of each pair beats the second
+    p_first = 1.0 / (1.0 + np.exp(decision * model.probA_ + model.probB_))
+    r = np.concatenate((p_first[first == winner], 1.0 - p_first[second == winner]))
+    confidence = 1.0 / (1.0 + np.sum((1.0 - r) / r))
+    return winner, confidence
+
+
 def predict_gesture(raw_gesture_data: np.ndarray):
     """
     Processes raw (N, 3) gesture data and predicts the letter and confidence.
@@ -88,27 +176,38 @@ def predict_gesture(raw_gesture_data: np.ndarray):
     NOTE: This version always returns the top prediction, regardless of confidence.
           The display logic (UNSURE vs. CONFIDENT) is handled in __main__.
           
-    Returns: A tuple (top_prediction, top_confidences) where top_confidences 
-             is a list of (label, confidence) for the top 3 results.
+    Returns: A tuple (top_prediction, top_confidences) where top_confidences
+             is a list of (label, confidence), best first:
+             - Clear-cut SVC result (confidence >= CONFIDENCE_THRESHOLD): a single
+               entry, whose confidence is the _ovo_vote estimate from the pairwise
+               Platt probabilities, not a predict_proba value.
+             - Otherwise: up to 3 entries with predict_proba values.
+             Empty for NO_DATA / FEATURE_ERROR.
     """
     
     if raw_gesture_data.shape[0] == 0:
         return "NO_DATA", []
 
-    # 1. Feature Extraction and Reshaping (1, F)
+    # 1. Feature Extraction straight into the (1, F) inference buffer
     try:
-        features = extract_features(raw_gesture_data)
-        X_new = features.reshape(1, -1) 
+        _X_BUF[0] = extract_features(raw_gesture_data)
     except Exception as e:
         print(f"Error during feature extraction: {e}")
         return "FEATURE_ERROR", []
 
-    # 2. Scaling: Use the LOADED scaler
-    X_new_scaled = scaler.transform(X_new)
+    # 2. Scaling: Use the LOADED scaler's statistics, in place
+    X_new_scaled = _scale_features_inplace(_X_BUF)
     
     # 3. Prediction and Probability
-    # Get the predicted label (the one with the highest probability)
-    prediction = model.predict(X_new_scaled)[0] 
+    if _OVO_PAIRS is not None:
+        winner, confidence = _ovo_vote(model.decision_function(X_new_scaled)[0])
+        prediction = model.classes_[winner]
+        # Clear-cut result: skip the second kernel evaluation in predict_proba
+        if confidence >= CONFIDENCE_THRESHOLD:
+            return prediction, [(prediction, confidence)]
+    else:
+        # Get the predicted label (the one with the highest probability)
+        prediction = model.predict(X_new_scaled)[0] 
     
     top_confidences = []
 
@@ -119,14 +218,14 @@ def predict_gesture(raw_gesture_data: np.ndarray):
         # Get class labels from the model
         classes = model.classes_
         
-        # Combine probabilities and classes, then sort by probability (descending)
-        sorted_indices = np.argsort(probabilities)[::-1]
+        # Select the top N predictions (up to 3) without sorting every class,
+        # then order just those by probability (descending)
+        k = min(3, len(classes))
+        top_indices = np.argpartition(probabilities, -k)[-k:]
+        top_indices = top_indices[np.argsort(probabilities[top_indices])[::-1]]
         
-        # Extract top N predictions (up to 3)
-        for i in range(min(3, len(classes))):
-            label = classes[sorted_indices[i]]
-            conf = probabilities[sorted_indices[i]]
-            top_confidences.append((label, conf))
+        for i in top_indices:
+            top_confidences.append((classes[i], probabilities[i]))
         
     # Return the highest probability prediction and the list of top confidences
     return prediction, top_confidences
@@ -1,54 +1,104 @@
+import hashlib
+import io
 import json
+import pickle
+from contextlib import redirect_stdout
 import numpy as np
 from pathlib import Path
+
+try:
+    # scikit-learn-intelex is optional: when installed it swaps in oneDAL versions of
+    # SVC, RandomForest, KNN and StandardScaler. Must run before sklearn is imported.
+    from sklearnex import patch_sklearn
+    patch_sklearn()
+except ImportError:
+    pass
+
+from sklearn import set_config
 from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.svm import SVC
 from sklearn.metrics import confusion_matrix, classification_report
-import matplotlib.pyplot as plt
-import seaborn as sns
+from sklearn.metrics.pairwise import rbf_kernel
 
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import StratifiedShuffleSplit, StratifiedKFold
+from sklearn.base import clone
+# sklearn's Parallel/delayed carry the set_config settings into the worker processes
+from sklearn.utils.parallel import Parallel, delayed
 import joblib
 
-# NOTE: This requires the 'features.py' file with the 'extract_features' function defined.
-from features import extract_features
+try:
+    import orjson
+except ImportError:
+    # Optional; build_features parses the dataset with json without it (and only
+    # parses at all when the feature cache misses).
+    orjson = None
+
+# NOTE: This requires the 'features.py' file with the 'extract_capture_features' function defined.
+import features
+from features import extract_capture_features, FEATURE_DTYPE
+
+# The features are checked for NaN/inf once below, so the estimators can skip
+# repeating that check on every fit, score and predict
+set_config(assume_finite=True)
 
 # === Paths ===
 DATA_PATH = Path("data/merged_sitting_lying.json") # *** Make sure the SAME as realtime_predictor.py ***
 MODEL_DIR = Path("models")
 MODEL_DIR.mkdir(exist_ok=True)
 
+# === Configuration ===
+# Worker processes for training the candidate models side by side (-1 = all cores)
+N_JOBS = -1
+# Cross-validation folds only run in parallel when the models train one at a time;
+# nesting them inside the model workers would just oversubscribe the cores
+CV_N_JOBS = -1 if N_JOBS == 1 else 1
+# Histogram gradient boosting replaces the (much slower to train) Random Forest;
+# set to True to also train the Random Forest for comparison
+INCLUDE_RANDOM_FOREST = False
+
+# Extracted features are cached on disk and reused while the data is unchanged
+feature_cache = joblib.Memory(MODEL_DIR / "_cache", verbose=0)
+
+
+@feature_cache.cache(ignore=["raw"])
+def build_features(raw: bytes, data_digest: str, features_digest: str):
+    """
+    Parses the raw dataset JSON and returns the (X, y) feature matrix and labels.
+    
+    The cache key is the content digests of the dataset and features.py rather
+    than the raw bytes themselves, so a rerun on unchanged inputs costs one hash
+    and skips both parsing and feature extraction.
+    """
+    data = orjson.loads(raw)["data"] if orjson is not None else json.loads(raw)["data"]
+
+    # Convert gestures to feature vectors, written into one preallocated float32 matrix
+    return extract_capture_features(data)
+
+
 print(f"Loading dataset from: {DATA_PATH}")
 
 # === Load and Process Data ===
 try:
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)["data"]
+    raw = DATA_PATH.read_bytes()
+    X, y = build_features(
+        raw,
+        hashlib.blake2b(raw).hexdigest(),
+        hashlib.blake2b(Path(features.__file__).read_bytes()).hexdigest(),
+    )
 except Exception as e:
     print(f"Error loading data: {e}. Please ensure data/pi_gesture_data_merged_all.json exists and is valid.")
     exit()
 
-X, y = [], []
-
-# Convert gestures to feature vectors
-for letter, content in data.items():
-    for cap in content["captures"]:
-        if len(cap["x"]) > 0:
-            x = np.array([cap["x"], cap["y"], cap["z"]]).T  # shape: (N,3)
-            # Assuming extract_features returns a 1D feature vector
-            feats = extract_features(x)
-            X.append(feats)
-            y.append(letter)
-
-if not X:
+if len(y) == 0:
     print("Error: No features extracted. Exiting.")
     exit()
 
-X = np.array(X)
-y = np.array(y)
+if not np.isfinite(X).all():
+    print("Error: Extracted features contain NaN or infinite values. Exiting.")
+    exit()
 
 # Define LABELS
 LABELS = sorted(np.unique(y))
@@ -57,20 +107,41 @@ print(f"Total samples: {len(y)} | Features per sample: {X.shape[1]}")
 print(f"Classes: {LABELS}")
 
 # === Split and scale ===
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
+# X is a C-contiguous float32 matrix and StandardScaler preserves float32, so the
+# tree and KNN models train on it without converting (trees work in float32).
+X = np.ascontiguousarray(X, dtype=FEATURE_DTYPE)
+# The same split train_test_split(X, y, test_size=0.2, stratify=y, random_state=42) makes
+train_idx, test_idx = next(StratifiedShuffleSplit(n_splits=1, test_size=0.2, random_state=42).split(X, y))
+
+# Reorder once so the training rows come first: the train and test sets are then
+# views of a single scaled matrix (indexing by train_idx/test_idx would copy both)
+n_train = len(train_idx)
+order = np.concatenate((train_idx, test_idx))
+X, y = X[order], y[order]
+y_train, y_test = y[:n_train], y[n_train:]
+
+scaler = StandardScaler().fit(X[:n_train])
+X_scaled = scaler.transform(X)
+X_train_scaled, X_test_scaled = X_scaled[:n_train], X_scaled[n_train:]
+
+def save_artifact(obj, path):
+    """Pickles a trained object for realtime_predictor.py: newest protocol, uncompressed."""
+    joblib.dump(obj, path, compress=0, protocol=pickle.HIGHEST_PROTOCOL)
 
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
 
 # Save scaler once
-joblib.dump(scaler, MODEL_DIR / "scaler.pkl")
+save_artifact(scaler, MODEL_DIR / "scaler.pkl")
 print(f"✅ Saved scaler in {MODEL_DIR}/scaler.pkl")
 
 
 # --- Model Training and Evaluation Function ---
-def train_eval_model(model, X_train, y_train, X_test, y_test, LABELS):
-    """Trains, evaluates, and saves a model, including report and confusion matrix."""
+def fit_and_score(model, X_fit, y_fit, X_val, y_val):
+    """Fits a fresh copy of model on one CV fold and returns its validation accuracy."""
+    return clone(model).fit(X_fit, y_fit).score(X_val, y_val)
+
+
+def train_eval_model(model, X_train, y_train, X_test, y_test, LABELS, cv_n_jobs=1):
+    """Trains and evaluates a model, printing its report and returning its confusion matrix."""
     model_name = model.__class__.__name__
     
     # Check if we are testing a specific SVM C parameter
@@ -81,16 +152,39 @@ def train_eval_model(model, X_train, y_train, X_test, y_test, LABELS):
     print(f"--- Training and Evaluating {model_name} ---")
     print("="*70)
     
-    # 1. Train Model
-    model.fit(X_train, y_train)
-    
-    # 2. Cross-validation
-    cv_scores = cross_val_score(model, X_train, y_train, cv=5, n_jobs=-1)
+    # Tree builders scan one feature column at a time, so they are fit on
+    # Fortran-ordered data; SVC (libsvm) and KNN read whole samples and keep C order.
+    if isinstance(model, (RandomForestClassifier, DecisionTreeClassifier)):
+        fit_layout = np.asfortranarray
+    else:
+        fit_layout = np.asarray
+
+    # With a precomputed kernel, X_train is the (train x train) kernel matrix and
+    # X_test the (test x train) one, so a fold keeps only its training columns
+    if getattr(model, "kernel", None) == "precomputed":
+        fold = lambda X, rows, train_rows: X[np.ix_(rows, train_rows)]
+    else:
+        fold = lambda X, rows, train_rows: X[rows]
+
+    # 1. Cross-validation over the same stratified 5 folds that cross_val_score(cv=5)
+    # uses. With cv_n_jobs=1 joblib runs the folds inline, without a worker pool.
+    cv_scores = np.array(Parallel(n_jobs=cv_n_jobs)(
+        delayed(fit_and_score)(
+            model,
+            fit_layout(fold(X_train, train_idx, train_idx)), y_train[train_idx],
+            fold(X_train, val_idx, train_idx), y_train[val_idx],
+        )
+        for train_idx, val_idx in StratifiedKFold(n_splits=5).split(X_train, y_train)
+    ))
     print(f"CV accuracy: {cv_scores.mean():.3f} ± {cv_scores.std():.3f}")
 
+    # 2. Train Model
+    model.fit(fit_layout(X_train), y_train)
+
     # 3. Test set prediction & Accuracy
     y_pred = model.predict(X_test)
-    test_acc = model.score(X_test, y_test)
+    # Same value as model.score, without predicting the test set a second time
+    test_acc = float(np.mean(y_pred == y_test))
     print(f"Test accuracy: {test_acc:.3f}")
 
     # 4. Classification Report to terminal
@@ -99,49 +193,118 @@ def train_eval_model(model, X_train, y_train, X_test, y_test, LABELS):
     report = classification_report(y_test, y_pred, labels=LABELS, zero_division=0)
     print(report)
 
-    # 5. Save Confusion Matrix as PNG Heatmap
+    # 5. Confusion matrix, saved by save_model_outputs in the main process
     cm = confusion_matrix(y_test, y_pred, labels=LABELS)
 
-    plt.rcParams.update({'font.size': 12})
-    plt.figure(figsize=(10,8))
-    sns.heatmap(
-        cm, annot=True, fmt='d', cmap='YlGnBu',
-        xticklabels=LABELS, yticklabels=LABELS, cbar=False,
-        linewidths=.5, linecolor='gray', annot_kws={"fontsize": 10}
-    )
-    plt.title(f'Confusion Matrix: {model_name} (Acc: {test_acc:.3f})')
-    plt.ylabel('True Label')
-    plt.xlabel('Predicted Label')
-    plt.tight_layout()
+    return model_name, test_acc, model, cv_scores.mean(), cm
+
+
+def train_eval_model_captured(*args):
+    """
+    Runs train_eval_model in a worker process and returns (console output, results).
+    
+    Capturing stdout lets the main process print each model's report in order
+    instead of interleaving the output of models trained at the same time.
+    """
+    with io.StringIO() as output, redirect_stdout(output):
+        results = train_eval_model(*args)
+        return output.getvalue(), results
+
+
+_pyplot = None
+
+
+def pyplot_module():
+    """
+    Returns matplotlib.pyplot, importing and configuring it on first use.
+    
+    The import adds a few hundred ms, which is now only paid once training has
+    produced something to plot (not when the script exits early).
+    """
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        matplotlib.use('Agg')  # Plots are only saved to PNG, never shown
+        import matplotlib.pyplot as plt
+        # Style shared by every plot, set once rather than before each heatmap
+        plt.rcParams.update({'font.size': 12})
+        _pyplot = plt
+    return _pyplot
+
+
+def save_model_outputs(model_name, test_acc, model, cm, LABELS):
+    """Saves a trained model's confusion matrix heatmap and, except for SVC candidates, the model."""
+    plt = pyplot_module()
+    # One figure is reused (and cleared) for every model's heatmap
+    fig = plt.figure(num="confusion_matrix", figsize=(10,8), clear=True)
+    ax = fig.add_subplot()
+    image = ax.imshow(cm, cmap='YlGnBu', aspect='auto')
+
+    # Cell borders between the classes
+    ticks = np.arange(len(LABELS))
+    ax.set_xticks(ticks, labels=LABELS)
+    ax.set_yticks(ticks, labels=LABELS, rotation=90, va='center')
+    ax.set_xticks(np.append(ticks, len(LABELS)) - 0.5, minor=True)
+    ax.set_yticks(np.append(ticks, len(LABELS)) - 0.5, minor=True)
+    ax.grid(which='minor', color='gray', linewidth=.5)
+    ax.tick_params(which='minor', length=0)
+    ax.spines[:].set_visible(False)
+
+    # Counts in every cell, white on dark cells and black on light ones: the sRGB
+    # relative luminance of each cell colour against seaborn's .408 threshold, so
+    # the PNGs read the same as the old sns.heatmap ones
+    rgb = image.cmap(image.norm(cm))[..., :3]
+    rgb = np.where(rgb <= .03928, rgb / 12.92, ((rgb + .055) / 1.055) ** 2.4)
+    luminance = rgb @ [.2126, .7152, .0722]
+    for (i, j), count in np.ndenumerate(cm):
+        ax.text(j, i, count, ha='center', va='center', fontsize=10,
+                color='black' if luminance[i, j] > .408 else 'white')
+
+    ax.set_title(f'Confusion Matrix: {model_name} (Acc: {test_acc:.3f})')
+    ax.set_ylabel('True Label')
+    ax.set_xlabel('Predicted Label')
+    fig.tight_layout()
 
     cm_filename = MODEL_DIR / f"{model_name}_confusion_matrix.png"
-    plt.savefig(cm_filename)
-    plt.close()
+    fig.savefig(cm_filename)
     print(f"Confusion matrix saved to: {cm_filename}") 
 
-    # 6. Save Model (Only save the best SVM iteration later)
+    # Save Model (Only save the best SVM iteration later)
     if not model_name.startswith('SVC_C'):
-        joblib.dump(model, MODEL_DIR / f"{model_name}_gesture_model.pkl")
+        save_artifact(model, MODEL_DIR / f"{model_name}_gesture_model.pkl")
         print(f"✅ Saved model {model_name} in {MODEL_DIR}/")
-    
-    return model_name, test_acc, model, cv_scores.mean()
 
 
 # --- Initialize and Run All Models ---
 
-# Run SVM with multiple C values to manually find a good parameter
+# Run SVM with multiple C values to manually find a good parameter.
+# The search only predicts, so Platt scaling (probability=True, an extra internal
+# 5-fold fit) is enabled only when the winner is refit below.
+# The RBF kernel matrix does not depend on C, so it is computed once and shared by
+# every candidate (kernel='precomputed'). gamma is what SVC's default
+# gamma='scale' picks for the training data, in float64 like libsvm.
+X_train_svm = X_train_scaled.astype(np.float64)
+svm_gamma = 1.0 / (X_train_svm.shape[1] * X_train_svm.var())
+K_train = rbf_kernel(X_train_svm, gamma=svm_gamma)
+K_test = rbf_kernel(X_test_scaled.astype(np.float64), X_train_svm, gamma=svm_gamma)
+
+# cache_size (MB) holds more of the kernel matrix between SMO iterations.
 svm_candidates = [
-    SVC(kernel='rbf', C=1.0, random_state=42, probability=True),
-    SVC(kernel='rbf', C=10.0, random_state=42, probability=True),
-    SVC(kernel='rbf', C=100.0, random_state=42, probability=True),
+    SVC(kernel='precomputed', C=1.0, random_state=42, cache_size=500),
+    SVC(kernel='precomputed', C=10.0, random_state=42, cache_size=500),
+    SVC(kernel='precomputed', C=100.0, random_state=42, cache_size=500),
 ]
 
-# Primary models list (RF, DT, KNN, and the best-performing SVM)
+# Primary models list (HGB, DT, KNN, optionally RF, and the best-performing SVM)
+# Each model gets one core (n_jobs=1): the parallelism is across models below.
 models_to_run = [
-    RandomForestClassifier(n_estimators=200, random_state=42, n_jobs=-1),
+    HistGradientBoostingClassifier(max_iter=200, max_depth=8, early_stopping=True, random_state=42),
     DecisionTreeClassifier(max_depth=10, random_state=42),
-    KNeighborsClassifier(n_neighbors=5, n_jobs=-1),
+    # Brute force: one distance GEMM per query batch, no tree to build per fit
+    KNeighborsClassifier(n_neighbors=5, algorithm='brute', metric='euclidean', n_jobs=1),
 ]
+if INCLUDE_RANDOM_FOREST:
+    models_to_run.append(RandomForestClassifier(n_estimators=200, random_state=42, n_jobs=1))
 
 # Track results for comparison chart
 results = []
@@ -149,39 +312,54 @@ best_svm_acc = 0
 best_svm_model = None
 best_svm_name = ""
 
-# 1. Run primary models
-for model in models_to_run:
-    name, acc, _, _ = train_eval_model(model, X_train_scaled, y_train, X_test_scaled, y_test, LABELS)
+# Every candidate is independent, so all of them train at once in worker processes
+# (the SVC candidates on the shared kernel matrices instead of the features)
+jobs = [(model, X_train_scaled, X_test_scaled) for model in models_to_run]
+jobs += [(svm, K_train, K_test) for svm in svm_candidates]
+outputs = Parallel(n_jobs=N_JOBS, backend="loky")(
+    delayed(train_eval_model_captured)(model, X_tr, y_train, X_te, y_test, LABELS, CV_N_JOBS)
+    for model, X_tr, X_te in jobs
+)
+
+# 1. Report primary models
+for log, (name, acc, trained_model, _, cm) in outputs[:len(models_to_run)]:
+    print(log, end="")
+    save_model_outputs(name, acc, trained_model, cm, LABELS)
     results.append({'model': name, 'accuracy': acc})
 
-# 2. Run SVM candidates and find the best one
+# 2. Report SVM candidates and find the best one
 print("\n" + "#"*70)
 print("--- Evaluating SVM Hyperparameter C (1, 10, 100) ---")
 print("#"*70)
-for svm in svm_candidates:
-    name, acc, trained_model, _ = train_eval_model(svm, X_train_scaled, y_train, X_test_scaled, y_test, LABELS)
+for log, (name, acc, trained_model, _, cm) in outputs[len(models_to_run):]:
+    print(log, end="")
+    save_model_outputs(name, acc, trained_model, cm, LABELS)
     
     if acc > best_svm_acc:
         best_svm_acc = acc
         best_svm_model = trained_model
         best_svm_name = name.replace("SVM_", "") # e.g., "C10"
 
-# 3. Save the best SVM model
+# 3. Save the best SVM model, refit on the features with the RBF kernel (same gamma,
+# via gamma='scale') and probabilities, as realtime_predictor.py expects
 if best_svm_model:
+    best_svm_model = clone(best_svm_model).set_params(kernel='rbf', probability=True).fit(X_train_scaled, y_train)
     final_svm_name = f"SVC_BEST_{best_svm_name}"
-    joblib.dump(best_svm_model, MODEL_DIR / f"{final_svm_name}_gesture_model.pkl")
+    save_artifact(best_svm_model, MODEL_DIR / f"{final_svm_name}_gesture_model.pkl")
     print(f"✅ Saved best SVM model ({final_svm_name}) in {MODEL_DIR}/")
     results.append({'model': final_svm_name, 'accuracy': best_svm_acc})
 
 # --- Final Model Comparison Visualization ---
 
+plt = pyplot_module()
 model_names = [r['model'] for r in results]
 accuracies = [r['accuracy'] for r in results]
 
 plt.figure(figsize=(10, 6))
-# Ensure the colors are consistent and visually appealing
-colors = sns.color_palette("viridis", len(model_names))
-sns.barplot(x=model_names, y=accuracies, palette=colors)
+# Ensure the colors are consistent and visually appealing: evenly spaced viridis
+# colours, excluding the two extremes
+colors = plt.get_cmap("viridis")(np.linspace(0, 1, len(model_names) + 2)[1:-1])
+plt.bar(model_names, accuracies, color=colors)
 
 plt.title('Gesture Classifier Model Comparison (Test Accuracy)')
 plt.ylabel('Test Accuracy Score')